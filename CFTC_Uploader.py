@@ -116,8 +116,11 @@ class Uploader():
         
         return lst
 
-    def create_database(self):
-        """Creates the SQL database"""
+    def create_database(self, checkpoint = False):
+        """Creates the SQL database. In checkpoint mode, every contract is 
+        committed on its own and logged into the BuildJournal table, so that 
+        calling it again after an interruption resumes from the first 
+        incomplete ticker"""
         
         # SQL queries to create tables
         table_date = """CREATE TABLE IF NOT EXISTS Date (
@@ -153,6 +156,9 @@ class Uploader():
           FOREIGN KEY (id_actor) REFERENCES Actor(id_actor),
           FOREIGN KEY (id_date) REFERENCES Date(id_date),
           FOREIGN KEY (id_commo) REFERENCES Contract(id_commo));"""
+        
+        table_journal = """CREATE TABLE IF NOT EXISTS BuildJournal (
+          Ticker VARCHAR(255) PRIMARY KEY);"""
                 
         # Connection
         conn = sqlite3.connect(self.db_name)
@@ -164,23 +170,35 @@ class Uploader():
         c.execute(table_actor)
         c.execute(table_contract)
         c.execute(table_position)
+        c.execute(table_journal)
         
-        # ----- Database feeding -----  
-        # Report type
-        c.execute('INSERT INTO Report(Type) VALUES (?)', ('Legacy',))
-        id_report = c.lastrowid
+        # Tickers already loaded by a previous interrupted build
+        done = self.extract_journal(conn) if checkpoint else set()
         
-        # Actors: feed the databse and keep a dictionnary of IDs
+        # ----- Database feeding -----  
+        # Actors of a previous build, if any
+        act_dict = self.extract_actors_ids(conn)
         actors = self.get_actors()
-        act_dict = {}
         
-        for act in actors:
-            c.execute('INSERT INTO Actor(Name, id_report) VALUES (?,?)', (act, id_report))
-            act_dict[act] = c.lastrowid
+        if len(act_dict) == 0:
+            
+            # Report type
+            c.execute('INSERT INTO Report(Type) VALUES (?)', ('Legacy',))
+            id_report = c.lastrowid
+            
+            # Actors: feed the databse and keep a dictionnary of IDs
+            for act in actors:
+                c.execute('INSERT INTO Actor(Name, id_report) VALUES (?,?)', (act, id_report))
+                act_dict[act] = c.lastrowid
         
         
         for i in self.mapping.index:
             tick = self.mapping.loc[i, 'code_cftc']
+            
+            # Skip the contracts completed by a previous build
+            if str(tick) in done:
+                continue
+            
             alias = self.mapping.loc[i, 'abbreviation']
             commo = self.mapping.loc[i, 'commo']
             market = self.mapping.loc[i, 'market']
@@ -212,6 +230,11 @@ class Uploader():
                         
                         c.execute('INSERT INTO Position(Value, Type, Crop, id_actor, id_date, id_commo) VALUES (?,?,?,?,?,?)',
                                   (df.loc[dts, var], pos_type, crop_type, act_dict[var.split(' ')[0]], id_date, id_commo))
+            
+            # Commit the contract together with its journal entry
+            if checkpoint:
+                c.execute('INSERT INTO BuildJournal (Ticker) VALUES (?)', (str(tick),))
+                conn.commit()
                         
         # Save changes and close the connection
         conn.commit()
@@ -302,6 +325,15 @@ class Uploader():
             
         return act_dict
     
+    def extract_journal(self, conn):
+        """Extract the tickers already completed by a checkpointed build"""
+        
+        # Query
+        c = conn.cursor()
+        c.execute("SELECT Ticker FROM BuildJournal")
+        
+        return set(e[0] for e in c.fetchall())
+    
     def extract_commo_id(self, conn, commo):
         """Extract ID for a specific commodity"""
         
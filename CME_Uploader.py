@@ -10,9 +10,45 @@ import sys
 import datetime
 import quandl
 import sqlite3
+import requests
+import multiprocessing
 import pandas as pd
 
 from pandas.tseries.offsets import *
+from Cold_Storage import encode_series, decode_series
+
+# Futures month codes, from January to December
+MONTH_CODES = 'FGHJKMNQUVXZ'
+
+# Download errors which may not happen again, a checkpointed build stops on them
+TRANSIENT_ERRORS = (quandl.errors.quandl_error.LimitExceededError,
+                    quandl.errors.quandl_error.InternalServerError,
+                    quandl.errors.quandl_error.ServiceUnavailableError,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout)
+
+def build_shard(args):
+    """Build the database shard of a subset of root commodities, in a worker 
+    process. Ids are local to the shard and remapped at the merge. Returns 
+    the shard name, its roots and the error which stopped it, if any"""
+    
+    uploader, db_name, roots = args
+    
+    # Restrict the uploader to the roots of the shard
+    uploader.db_name = db_name
+    uploader.contracts = [x for x in uploader.contracts if x[:-5] in roots]
+    uploader.df_dash = uploader.df_dash[uploader.df_dash['SYMBOL'].isin(roots)]
+    
+    # The API key is not inherited by spawned processes
+    uploader.init_quandl()
+    
+    # Report the error, so that the other shards are still merged
+    try:
+        uploader.create_database(checkpoint = True)
+    except Exception as e:
+        return db_name, roots, repr(e)
+    
+    return db_name, roots, None
 
 class Uploader():
     """ Algorithm designed to create and then update the Quandl CME Database. 
@@ -93,8 +129,224 @@ class Uploader():
         return quandl.get('CME/' + tick, start_date = dts_beg.strftime('%Y-%m-%d'), 
                           end_date = dts_end.strftime('%Y-%m-%d'))
     
-    def create_database(self):
-        """Create the database with market data"""
+    def create_database(self, checkpoint = False):
+        """Create the database with market data. In checkpoint mode, every 
+        contract is committed on its own and logged into the BuildJournal 
+        table, so that calling it again after an interruption resumes from 
+        the first incomplete ticker. A transient download error then stops 
+        the build instead of being skipped, other errors still skip the 
+        contract"""
+        
+        # Connection
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        
+        # Create tables
+        self.create_tables(c)
+        
+        # Tickers already loaded by a previous interrupted build
+        done = self.get_journal(c) if checkpoint else set()
+        
+        # Database feeding
+        # Dates, keeping the ones saved by a previous build
+        date_dict = self.get_dates(c)
+        d0 = datetime.datetime.today()
+        d1 = datetime.date(self.dts.year, self.dts.month, self.dts.day)
+        d2 = datetime.date(d0.year, d0.month, d0.day)
+        
+        delta = d2 - d1
+        
+        for i in range(delta.days + 1):
+            if d1 + datetime.timedelta(days = i) not in date_dict:
+                c.execute('INSERT INTO Date (Date) VALUES (?)', (d1 + datetime.timedelta(days = i),))
+                date_dict[d1 + datetime.timedelta(days = i)] = c.lastrowid
+            
+        # Root commodities, keeping the ones saved by a previous build
+        c.execute('SELECT Alias, id_root FROM RootCommodity')
+        root_dict = dict(c.fetchall())
+        
+        for i in self.df_dash.index:
+            if self.df_dash.loc[i, 'SYMBOL'] not in root_dict:
+                c.execute('INSERT INTO RootCommodity (Name, Market, Alias) VALUES (?,?,?)', (self.df_dash.loc[i, 'NAME'],
+                          self.df_dash.loc[i, 'EXCHANGE'], self.df_dash.loc[i, 'SYMBOL']))
+                root_dict[self.df_dash.loc[i, 'SYMBOL']] = c.lastrowid
+        
+        # Keep the dates and roots if a contract is rolled back
+        if checkpoint:
+            conn.commit()
+        
+        # Contracts   
+        for ctrc in self.contracts:
+            
+            # Skip the contracts completed by a previous build
+            if ctrc in done:
+                continue
+            
+            id_root = root_dict[ctrc[:-5]]
+            m, yr = ctrc[-5:-4], int(ctrc[-4:])
+            
+            # Reuse the contract if it is already in the database
+            c.execute('SELECT id_contract FROM Contract WHERE id_root = ? AND Month = ? AND Year = ?', (id_root, m, yr))
+            res = c.fetchall()
+            
+            if len(res) > 0:
+                id_contract = res[0][0]
+            else:
+                c.execute('INSERT INTO Contract (Month, Year, id_root) VALUES (?,?,?)', (m, yr, id_root))
+                id_contract = c.lastrowid
+            
+            # Extract Quandl data, test if request works
+            try:
+                df = self.quandl_extract(ctrc, d1, d2)
+                
+                # Loop through dates
+                for i in df.index:
+                    
+                    # Extract info to put in the database
+                    d, px, v, oi = self.extract_info(i, df)
+                                 
+                    c.execute('INSERT OR IGNORE INTO contract_date (Price, OpenInterest, Volume, id_date, id_contract) VALUES (?,?,?,?,?)',
+                              (px, oi, v, date_dict[d], id_contract))
+            
+            except TRANSIENT_ERRORS:
+                # Drop the partially loaded contract and stop the build, it
+                # is left out of the journal and reloaded at the next call
+                if checkpoint:
+                    conn.rollback()
+                    conn.close()
+                    raise
+            
+            # The contract does not exist on Quandl, or its data is not valid
+            except:
+                pass
+            
+            # Commit the contract together with its journal entry
+            if checkpoint:
+                c.execute('INSERT INTO BuildJournal (Ticker) VALUES (?)', (ctrc,))
+                conn.commit()
+                
+        # Save changes and close the connection
+        conn.commit()
+        conn.close()
+        
+    def create_database_sharded(self, n_workers = None):
+        """Create the database with market data, splitting the root 
+        commodities across worker processes. Each worker builds its own shard
+        in checkpoint mode, then the shards are merged into the database. 
+        Each shard is merged as soon as it is complete, even if another one 
+        fails. Merged roots are logged into the MergeJournal table of the 
+        database and shards are kept until merged, so an interrupted build 
+        can be resumed by calling it again with the same n_workers"""
+        
+        # Connection
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        
+        # Roots already merged by a previous interrupted build
+        self.create_tables(c)
+        done = self.get_merged(c)
+        conn.commit()
+        conn.close()
+        
+        # All the root commodities, in the order of the dashboard
+        roots = list(self.df_dash['SYMBOL'])
+        
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        n_workers = max(1, min(n_workers, len(roots)))
+        
+        # Split all the roots across shards, so that a shard gets the same 
+        # roots again when resumed, and leave out the merged ones
+        shards = []
+        for k in range(n_workers):
+            shard_name = self.db_name.replace('.db', '') + '_shard' + str(k) + '.db'
+            shard_roots = [x for x in roots[k::n_workers] if x not in done]
+            
+            if len(shard_roots) > 0:
+                shards.append((self, shard_name, shard_roots))
+                
+        if len(shards) == 0:
+            return
+            
+        # Build the shards in parallel, and combine each of them into the 
+        # database as soon as it is complete
+        failed = []
+        pool = multiprocessing.Pool(len(shards))
+        try:
+            for shard_name, shard_roots, error in pool.imap_unordered(build_shard, shards):
+                if error is None:
+                    self.merge_shards([(shard_name, shard_roots)])
+                else:
+                    failed.append(shard_name + ' ' + error)
+        finally:
+            pool.close()
+            pool.join()
+            
+        assert(len(failed) == 0), 'Shards stopped, call again to resume: ' + ', '.join(failed)
+        
+    def merge_shards(self, shard_roots):
+        """Merge database shards into the database, remapping the ids of 
+        dates, roots and contracts. Takes a list of (shard name, roots of the
+        shard). The roots are logged into the MergeJournal table with the 
+        merge, and each shard is deleted once merged. Merging a shard twice 
+        leaves the database unchanged"""
+        
+        # Connection
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        
+        # Create tables
+        self.create_tables(c)
+        conn.commit()
+        
+        for shard_name, roots in shard_roots:
+            
+            c.execute('ATTACH DATABASE ? AS shard', (shard_name,))
+            
+            # Dates missing from the database
+            c.execute("""INSERT INTO main.Date (Date)
+                      SELECT DISTINCT Date FROM shard.Date
+                      WHERE Date NOT IN (SELECT Date FROM main.Date)
+                      ORDER BY Date;""")
+            
+            # Root commodities, matched on their alias
+            c.execute("""INSERT INTO main.RootCommodity (Name, Market, Alias)
+                      SELECT Name, Market, Alias FROM shard.RootCommodity
+                      WHERE Alias NOT IN (SELECT Alias FROM main.RootCommodity)
+                      ORDER BY id_root;""")
+            
+            # Contracts, with the new root ids
+            c.execute("""INSERT INTO main.Contract (Month, Year, id_root)
+                      SELECT sc.Month, sc.Year, r.id_root
+                      FROM shard.Contract sc, shard.RootCommodity sr, main.RootCommodity r
+                      WHERE sc.id_root = sr.id_root AND sr.Alias = r.Alias AND
+                      NOT EXISTS (SELECT 1 FROM main.Contract ct
+                      WHERE ct.id_root = r.id_root AND ct.Month = sc.Month AND ct.Year = sc.Year)
+                      ORDER BY sc.id_contract;""")
+            
+            # Market data, with the new date and contract ids
+            c.execute("""INSERT OR IGNORE INTO main.contract_date (Price, OpenInterest, Volume, id_date, id_contract)
+                      SELECT scd.Price, scd.OpenInterest, scd.Volume, d.id_date, ct.id_contract
+                      FROM shard.contract_date scd, shard.Date sd, shard.Contract sc,
+                      shard.RootCommodity sr, main.Date d, main.RootCommodity r, main.Contract ct
+                      WHERE scd.id_date = sd.id_date AND sd.Date = d.Date AND
+                      scd.id_contract = sc.id_contract AND sc.id_root = sr.id_root AND
+                      sr.Alias = r.Alias AND ct.id_root = r.id_root AND
+                      ct.Month = sc.Month AND ct.Year = sc.Year;""")
+            
+            # Log the roots of the shard as merged
+            for root in roots:
+                c.execute('INSERT OR IGNORE INTO main.MergeJournal (Alias) VALUES (?)', (root,))
+            
+            # Save changes and release the shard
+            conn.commit()
+            c.execute('DETACH DATABASE shard')
+            os.remove(shard_name)
+            
+        conn.close()
+        
+    def create_tables(self, c):
+        """Create the tables of the database, if they do not exist"""
         
         # SQL queries to create tables
         table_root = """ CREATE TABLE IF NOT EXISTS RootCommodity (
@@ -124,68 +376,109 @@ class Uploader():
                           FOREIGN KEY (id_date) REFERENCES Date(id_date)
                           ON DELETE CASCADE ON UPDATE NO ACTION,
                           FOREIGN KEY (id_contract) REFERENCES Contract(id_contract)
-                          ON DELETE CASCADE ON UPDATE NO ACTION);"""        
+                          ON DELETE CASCADE ON UPDATE NO ACTION);"""
         
-        # Connection
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
+        table_archive = """CREATE TABLE IF NOT EXISTS contract_archive (
+                          id_contract INTEGER PRIMARY KEY,
+                          Rows INT NOT NULL,
+                          Series BLOB NOT NULL,
+                          FOREIGN KEY (id_contract) REFERENCES Contract(id_contract)
+                          ON DELETE CASCADE ON UPDATE NO ACTION);"""
+        
+        table_journal = """CREATE TABLE IF NOT EXISTS BuildJournal (
+                          Ticker VARCHAR(20) PRIMARY KEY);"""
+        
+        table_merge = """CREATE TABLE IF NOT EXISTS MergeJournal (
+                          Alias VARCHAR(10) PRIMARY KEY);"""
+        
+        # Indexes on the natural keys, used to remap ids at the shard merge
+        index_date = """CREATE INDEX IF NOT EXISTS idx_date_date ON Date (Date);"""
+        
+        index_contract = """CREATE INDEX IF NOT EXISTS idx_contract_root_month_year 
+                          ON Contract (id_root, Month, Year);"""
         
-        # Create tables
         c.execute(table_root)
         c.execute(table_contracts)
         c.execute(table_date)
         c.execute(table_table)
+        c.execute(table_archive)
+        c.execute(table_journal)
+        c.execute(table_merge)
+        c.execute(index_date)
+        c.execute(index_contract)
+        
+    def archive_expired(self):
+        """Move the daily history of the expired contracts from contract_date
+        into contract_archive, as one compressed blob per contract. A contract
+        is expired once its delivery month is over. Rows written after a 
+        contract was archived are folded into its blob"""
         
-        # Database feeding
-        # Dates
-        date_dict = {}
-        d0 = datetime.datetime.today()
-        d1 = datetime.date(self.dts.year, self.dts.month, self.dts.day)
-        d2 = datetime.date(d0.year, d0.month, d0.day)
+        # Connection
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
         
-        delta = d2 - d1
+        # Create tables, for databases built before the archive existed
+        self.create_tables(c)
         
-        for i in range(delta.days + 1):
-            c.execute('INSERT INTO Date (Date) VALUES (?)', (d1 + datetime.timedelta(days = i),))
-            date_dict[d1 + datetime.timedelta(days = i)] = c.lastrowid
-            
-        # Root commodities
-        root_dict = {}
+        # Contracts with daily history still in contract_date
+        c.execute("""SELECT id_contract, Month, Year FROM Contract
+                  WHERE id_contract IN (SELECT DISTINCT id_contract FROM contract_date);""")
         
-        for i in self.df_dash.index:
-            c.execute('INSERT INTO RootCommodity (Name, Market, Alias) VALUES (?,?,?)', (self.df_dash.loc[i, 'NAME'],
-                      self.df_dash.loc[i, 'EXCHANGE'], self.df_dash.loc[i, 'SYMBOL']))
-            root_dict[self.df_dash.loc[i, 'SYMBOL']] = c.lastrowid
+        d0 = datetime.datetime.today()
         
-        # Contracts   
-        for ctrc in self.contracts:
+        for id_contract, m, yr in c.fetchall():
             
-            id_root = root_dict[ctrc[:-5]]
-            m, yr = ctrc[-5:-4], int(ctrc[-4:])
+            # Keep the contracts which are still alive
+            if (yr, MONTH_CODES.index(m) + 1) >= (d0.year, d0.month):
+                continue
             
-            c.execute('INSERT INTO Contract (Month, Year, id_root) VALUES (?,?,?)', (m, yr, id_root))
-            id_contract = c.lastrowid
+            c.execute("""SELECT Date.Date, contract_date.Price, contract_date.OpenInterest, contract_date.Volume
+                      FROM Date, contract_date
+                      WHERE Date.id_date = contract_date.id_date AND contract_date.id_contract = ?
+                      ORDER BY Date.Date;""", (id_contract,))
+            rows = [(datetime.datetime.strptime(x[0], '%Y-%m-%d').date(), x[1], x[2], x[3]) for x in c.fetchall()]
             
-            # Extract Quandl data, test if request works
-            try:
-                df = self.quandl_extract(ctrc, d1, d2)
-                
-                # Loop through dates
-                for i in df.index:
-                    
-                    # Extract info to put in the database
-                    d, px, v, oi = self.extract_info(i, df)
-                                 
-                    c.execute('INSERT INTO contract_date (Price, OpenInterest, Volume, id_date, id_contract) VALUES (?,?,?,?,?)',
-                              (px, oi, v, date_dict[d], id_contract))
-                    
-            except:
-                pass
-                
-        # Save changes and close the connection
+            # Contract already archived, its blob is kept for the dates in both
+            c.execute('SELECT Rows, Series FROM contract_archive WHERE id_contract = ?', (id_contract,))
+            res = c.fetchall()
+            
+            if len(res) > 0:
+                archived = [tuple(x) for x in decode_series(res[0][0], res[0][1]).itertuples(index = False)]
+                dts = set(x[0] for x in archived)
+                rows = sorted(archived + [x for x in rows if x[0] not in dts])
+            
+            # Replace the rows by the blob
+            n, blob = encode_series(rows)
+            c.execute('INSERT OR REPLACE INTO contract_archive (id_contract, Rows, Series) VALUES (?,?,?)', 
+                      (id_contract, n, sqlite3.Binary(blob)))
+            c.execute('DELETE FROM contract_date WHERE id_contract = ?', (id_contract,))
+            
+        # Save changes, give the space back and close the connection
         conn.commit()
+        c.execute('VACUUM')
         conn.close()
         
+    def get_journal(self, c):
+        """Select the tickers already completed by a checkpointed build"""
+        
+        c.execute('SELECT Ticker FROM BuildJournal')
+        
+        return set(x[0] for x in c.fetchall())
+    
+    def get_merged(self, c):
+        """Select the roots already merged by a sharded build"""
+        
+        c.execute('SELECT Alias FROM MergeJournal')
+        
+        return set(x[0] for x in c.fetchall())
+    
+    def get_dates(self, c):
+        """Select all dates in the database, with their ids"""
+        
+        c.execute('SELECT Date, id_date FROM Date')
+        
+        return {datetime.datetime.strptime(x[0], '%Y-%m-%d').date(): x[1] for x in c.fetchall()}
+        
     def get_last_date(self):
         """Select the last date saved in the database"""
         
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tools to store the full history of an expired contract as one compressed
+columnar blob, and to read it back.
+
+The blob is one byte with the format version, followed by the zlib 
+compression of four little-endian columns laid end to end:
+    : the dates, as int32 day ordinals, the first one absolute and the others
+    as differences with the previous date
+    : the prices, as float64
+    : the open interests, as int64
+    : the volumes, as int64
+The number of rows is saved next to the blob, in the database.
+"""
+
+# Import librairies
+import zlib
+import datetime
+import numpy as np
+import pandas as pd
+
+# Version of the blob layout, and bytes used by one row
+FORMAT_VERSION = 1
+ROW_SIZE = 4 + 8 + 8 + 8
+
+def encode_series(rows):
+    """Compress a list of (date, price, open interest, volume) rows, sorted by
+    date. Returns the number of rows and the blob"""
+    
+    # Split the columns, dates are converted into day ordinals
+    dts = np.array([x[0].toordinal() for x in rows], dtype = '<i4')
+    px = np.array([x[1] for x in rows], dtype = '<f8')
+    oi = np.array([x[2] for x in rows], dtype = '<i8')
+    v = np.array([x[3] for x in rows], dtype = '<i8')
+    
+    # Dates are close to each other, differences compress much better
+    dts[1:] = np.diff(dts)
+    
+    raw = dts.tobytes() + px.tobytes() + oi.tobytes() + v.tobytes()
+    
+    return len(rows), bytes([FORMAT_VERSION]) + zlib.compress(raw)
+
+def decode_series(n, blob):
+    """Decompress a blob of n rows into a DataFrame with the columns Date, 
+    Price, OpenInterest and Volume"""
+    
+    blob = bytes(blob)
+    assert(blob[0] == FORMAT_VERSION), 'Unknown archive format version ' + str(blob[0])
+    
+    raw = zlib.decompress(blob[1:])
+    assert(len(raw) == ROW_SIZE * n), 'Archive blob does not hold ' + str(n) + ' rows'
+    
+    # Offsets of the columns in the raw bytes
+    o1 = 4 * n
+    o2 = o1 + 8 * n
+    o3 = o2 + 8 * n
+    
+    dts = np.cumsum(np.frombuffer(raw[:o1], dtype = '<i4'))
+    
+    return pd.DataFrame({'Date': [datetime.date.fromordinal(int(x)) for x in dts],
+                         'Price': np.frombuffer(raw[o1:o2], dtype = '<f8'),
+                         'OpenInterest': np.frombuffer(raw[o2:o3], dtype = '<i8'),
+                         'Volume': np.frombuffer(raw[o3:], dtype = '<i8')},
+                        columns = ['Date', 'Price', 'OpenInterest', 'Volume'])
@@ -10,6 +10,8 @@ import datetime
 import sqlite3
 import pandas as pd
 
+from Cold_Storage import decode_series
+
 class DB_to_Excel():
     """Algorithm to extract the market data from the Database, and put it into
     a matrix format into a csv file. This is because we used to work like that
@@ -52,6 +54,27 @@ class DB_to_Excel():
         # Extract the data in a DataFrame format
         df = pd.DataFrame(c.fetchall(), columns = ['Date', 'Alias', 'Value'])
         
+        # Add the expired contracts from the archive
+        if self.has_archive(conn):
+            
+            c.execute("""SELECT (RootCommodity.Alias || Contract.Month || Contract.Year) as Alias, 
+                        contract_archive.Rows, contract_archive.Series
+                        FROM RootCommodity, Contract, contract_archive
+                        WHERE Contract.id_root = RootCommodity.id_root and
+                        contract_archive.id_contract = Contract.id_contract;""")
+            
+            # Decode every contract, then concatenate them all at once
+            frames = [df]
+            for alias, n, blob in c.fetchall():
+                df_cold = decode_series(n, blob)
+                frames.append(pd.DataFrame({'Date': [x.isoformat() for x in df_cold['Date']], 
+                                            'Alias': alias, 'Value': df_cold['Price'].values},
+                                           columns = ['Date', 'Alias', 'Value']))
+            df = pd.concat(frames, ignore_index = True)
+            
+            # Rows written after a contract was archived, keep the archive
+            df = df.drop_duplicates(subset = ['Date', 'Alias'], keep = 'last')
+        
         # Pivot it, in the matrix format I like, and convert the index
         df = df.pivot(index = 'Date', columns = 'Alias', values = 'Value')
         df.index = [datetime.datetime.strptime(x, '%Y-%m-%d') for x in df.index]
@@ -67,4 +90,49 @@ class DB_to_Excel():
         # Save the information in a csv format
         df.to_csv(self.chemin + 'mx_px.csv')
         
-        
\ No newline at end of file
+    def request_contract(self, alias):
+        """Extract the full daily history of one contract, such as 'CLZ2017',
+        from the archive if it is expired and from contract_date"""
+        
+        # Connection
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        
+        c.execute("""SELECT Date.Date, contract_date.Price, contract_date.OpenInterest, contract_date.Volume
+                    FROM Date, RootCommodity, Contract, contract_date
+                    WHERE Date.id_date = contract_date.id_date and
+                    Contract.id_root = RootCommodity.id_root and
+                    contract_date.id_contract = Contract.id_contract and
+                    (RootCommodity.Alias || Contract.Month || Contract.Year) = ?
+                    ORDER BY Date.Date;""", (alias,))
+        
+        df = pd.DataFrame(c.fetchall(), columns = ['Date', 'Price', 'OpenInterest', 'Volume'])
+        df['Date'] = [datetime.datetime.strptime(x, '%Y-%m-%d').date() for x in df['Date']]
+        
+        # Archived contracts are read as one blob
+        if self.has_archive(conn):
+            
+            c.execute("""SELECT contract_archive.Rows, contract_archive.Series
+                        FROM RootCommodity, Contract, contract_archive
+                        WHERE Contract.id_root = RootCommodity.id_root and
+                        contract_archive.id_contract = Contract.id_contract and
+                        (RootCommodity.Alias || Contract.Month || Contract.Year) = ?;""", (alias,))
+            res = c.fetchall()
+            
+            # Rows written after the contract was archived, keep the archive
+            if len(res) > 0:
+                df = pd.concat([decode_series(res[0][0], res[0][1]), df], ignore_index = True)
+                df = df.drop_duplicates(subset = ['Date'], keep = 'first').sort_values('Date')
+                
+        conn.close()
+        
+        return df.set_index('Date')
+    
+    def has_archive(self, conn):
+        """Test if the database has the archive of expired contracts"""
+        
+        c = conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'contract_archive'")
+        
+        return len(c.fetchall()) > 0
+        
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the CME uploader database builds, on small synthetic databases.
+Quandl is never called.
+"""
+
+# Import librairies
+import sqlite3
+import shutil
+import datetime
+import pytest
+import requests
+import numpy as np
+import pandas as pd
+
+from CME_Uploader import Uploader
+from Cold_Storage import decode_series
+
+def make_uploader(db_name):
+    """Uploader without the dashboard and the Quandl connection"""
+    
+    u = object.__new__(Uploader)
+    u.db_name = str(db_name)
+    
+    return u
+
+def make_builder(db_name, contracts):
+    """Uploader building the CL contracts over the last three days"""
+    
+    u = make_uploader(db_name)
+    u.dts = datetime.datetime.today() - datetime.timedelta(days = 2)
+    u.contracts = contracts
+    u.df_dash = pd.DataFrame({'SYMBOL': ['CL'], 'NAME': ['Crude Oil'], 'EXCHANGE': ['CME']})
+    
+    return u
+
+def fake_extract(downloads, fail = None, nan = None):
+    """Replacement of quandl_extract, logging the tickers downloaded. The 
+    fail ticker raises a connection error, the nan ticker has no volume"""
+    
+    def extract(tick, dts_beg, dts_end):
+        
+        if tick == fail:
+            raise requests.exceptions.ConnectionError('Connection dropped')
+        downloads.append(tick)
+        
+        index = pd.date_range(start = dts_beg, end = dts_end)
+        v = np.nan if tick == nan else 10.0
+        
+        return pd.DataFrame({'Settle': 50.0, 'Volume': v, 'Open Interest': 100.0}, index = index)
+    
+    return extract
+
+def make_shard(u, shard_name, roots, dts, offset):
+    """Build a shard with one contract per root and a price per date. The ids
+    of the shard start after offset, to differ from the database ones"""
+    
+    conn = sqlite3.connect(str(shard_name))
+    c = conn.cursor()
+    u.create_tables(c)
+    
+    # Shift the ids of the shard
+    for table, query in [('Date', "INSERT INTO Date (Date) VALUES ('1900-01-01')"),
+                         ('RootCommodity', "INSERT INTO RootCommodity (Name, Market, Alias) VALUES ('x','x','x')"),
+                         ('Contract', "INSERT INTO Contract (Month, Year, id_root) VALUES ('F', 1900, 0)")]:
+        for k in range(offset):
+            c.execute(query)
+        c.execute('DELETE FROM ' + table)
+        
+    for d in dts:
+        c.execute('INSERT INTO Date (Date) VALUES (?)', (d,))
+        
+    for r in roots:
+        c.execute("INSERT INTO RootCommodity (Name, Market, Alias) VALUES (?, 'CME', ?)", (r, r))
+        c.execute("INSERT INTO Contract (Month, Year, id_root) VALUES ('H', 2020, ?)", (c.lastrowid,))
+        id_contract = c.lastrowid
+        
+        for id_date, d in c.execute('SELECT id_date, Date FROM Date').fetchall():
+            conn.execute('INSERT INTO contract_date (Price, OpenInterest, Volume, id_date, id_contract) VALUES (?,?,?,?,?)',
+                         (float(len(r)) + int(d[-2:]), 100, 10, id_date, id_contract))
+            
+    conn.commit()
+    conn.close()
+
+def read_prices(db_name):
+    """Prices of the database, by date and contract"""
+    
+    conn = sqlite3.connect(str(db_name))
+    res = conn.execute("""SELECT Date.Date, (RootCommodity.Alias || Contract.Month || Contract.Year), contract_date.Price
+                       FROM Date, RootCommodity, Contract, contract_date
+                       WHERE Date.id_date = contract_date.id_date AND
+                       Contract.id_root = RootCommodity.id_root AND
+                       contract_date.id_contract = Contract.id_contract
+                       ORDER BY 1, 2;""").fetchall()
+    conn.close()
+    
+    return res
+
+def count_rows(db_name, table):
+    """Number of rows of a table"""
+    
+    conn = sqlite3.connect(str(db_name))
+    n = conn.execute('SELECT COUNT(*) FROM ' + table).fetchall()[0][0]
+    conn.close()
+    
+    return n
+
+def test_merge_shards(tmp_path):
+    """Shards with overlapping dates and their own ids are merged with 
+    remapped ids, and merging a shard twice changes nothing"""
+    
+    u = make_uploader(tmp_path / 'MarketData.db')
+    
+    dts_0 = [datetime.date(2020, 1, d) for d in (1, 2, 3)]
+    dts_1 = [datetime.date(2020, 1, d) for d in (2, 3, 4)]
+    
+    make_shard(u, tmp_path / 's0.db', ['CL', 'GC'], dts_0, 0)
+    make_shard(u, tmp_path / 's1.db', ['NG'], dts_1, 5)
+    shutil.copy(str(tmp_path / 's1.db'), str(tmp_path / 's1_copy.db'))
+    
+    u.merge_shards([(str(tmp_path / 's0.db'), ['CL', 'GC']), (str(tmp_path / 's1.db'), ['NG'])])
+    
+    # Dates are merged once, and the data points to the new ids
+    assert count_rows(u.db_name, 'Date') == 4
+    assert count_rows(u.db_name, 'RootCommodity') == 3
+    assert count_rows(u.db_name, 'Contract') == 3
+    assert count_rows(u.db_name, 'contract_date') == 9
+    
+    prices = read_prices(u.db_name)
+    assert ('2020-01-04', 'NGH2020', 6.0) in prices
+    assert ('2020-01-01', 'CLH2020', 3.0) in prices
+    assert not any(x[1] == 'NGH2020' and x[0] == '2020-01-01' for x in prices)
+    
+    # Ids are those of the database, not of the shard
+    conn = sqlite3.connect(u.db_name)
+    assert conn.execute("SELECT id_contract FROM Contract, RootCommodity WHERE Contract.id_root = RootCommodity.id_root AND Alias = 'NG'").fetchall() == [(3,)]
+    assert conn.execute('SELECT Alias FROM MergeJournal ORDER BY Alias').fetchall() == [('CL',), ('GC',), ('NG',)]
+    conn.close()
+    
+    # Merged shards are deleted
+    assert not (tmp_path / 's0.db').exists()
+    assert not (tmp_path / 's1.db').exists()
+    
+    # Merging the same shard again leaves the database unchanged
+    u.merge_shards([(str(tmp_path / 's1_copy.db'), ['NG'])])
+    
+    assert read_prices(u.db_name) == prices
+    assert count_rows(u.db_name, 'Contract') == 3
+    assert count_rows(u.db_name, 'MergeJournal') == 3
+
+def test_resume_after_connection_error(tmp_path):
+    """A connection error rolls the contract back and stops the build, and 
+    the next call loads only the contracts still missing"""
+    
+    contracts = ['CLF2020', 'CLG2020', 'CLH2020']
+    u = make_builder(tmp_path / 'MarketData.db', contracts)
+    
+    # First build, dropped on the second contract
+    downloads = []
+    u.quandl_extract = fake_extract(downloads, fail = 'CLG2020')
+    
+    with pytest.raises(requests.exceptions.ConnectionError):
+        u.create_database(checkpoint = True)
+        
+    conn = sqlite3.connect(u.db_name)
+    assert conn.execute('SELECT Ticker FROM BuildJournal').fetchall() == [('CLF2020',)]
+    assert conn.execute('SELECT Month FROM Contract').fetchall() == [('F',)]
+    conn.close()
+    assert count_rows(u.db_name, 'contract_date') == 3
+    
+    # Second build, resumed from the failed contract
+    downloads = []
+    u.quandl_extract = fake_extract(downloads)
+    u.create_database(checkpoint = True)
+    
+    assert downloads == ['CLG2020', 'CLH2020']
+    assert count_rows(u.db_name, 'BuildJournal') == 3
+    assert count_rows(u.db_name, 'Contract') == 3
+    assert count_rows(u.db_name, 'Date') == 3
+    assert count_rows(u.db_name, 'contract_date') == 9
+
+def test_bad_data_does_not_stop_build(tmp_path):
+    """A contract with invalid data is skipped and journaled, as it would 
+    fail again at every resume"""
+    
+    contracts = ['CLF2020', 'CLG2020']
+    u = make_builder(tmp_path / 'MarketData.db', contracts)
+    
+    downloads = []
+    u.quandl_extract = fake_extract(downloads, nan = 'CLF2020')
+    u.create_database(checkpoint = True)
+    
+    assert downloads == contracts
+    assert count_rows(u.db_name, 'BuildJournal') == 2
+    
+    # Nothing is downloaded again
+    downloads = []
+    u.quandl_extract = fake_extract(downloads)
+    u.create_database(checkpoint = True)
+    
+    assert downloads == []
+
+def make_market(db_name):
+    """Database with an expired and a live CL contract, over three dates. 
+    Returns the ids of the expired and the live contracts"""
+    
+    u = make_uploader(db_name)
+    conn = sqlite3.connect(u.db_name)
+    c = conn.cursor()
+    u.create_tables(c)
+    
+    for d in (1, 2, 3):
+        c.execute('INSERT INTO Date (Date) VALUES (?)', (datetime.date(2020, 1, d),))
+    c.execute("INSERT INTO RootCommodity (Name, Market, Alias) VALUES ('Crude Oil', 'CME', 'CL')")
+    
+    ids = []
+    for m, yr in [('F', 2020), ('Z', datetime.date.today().year + 1)]:
+        c.execute('INSERT INTO Contract (Month, Year, id_root) VALUES (?, ?, 1)', (m, yr))
+        ids.append(c.lastrowid)
+        for id_date in (1, 2, 3):
+            c.execute('INSERT INTO contract_date (Price, OpenInterest, Volume, id_date, id_contract) VALUES (?,?,?,?,?)',
+                      (50.0 + id_date, 100 * id_date, 10 * id_date, id_date, ids[-1]))
+            
+    conn.commit()
+    conn.close()
+    
+    return u, ids[0], ids[1]
+
+def test_archive_expired(tmp_path):
+    """Only the expired contract is moved into the archive, as one blob 
+    holding all its rows"""
+    
+    u, id_expired, id_live = make_market(tmp_path / 'MarketData.db')
+    u.archive_expired()
+    
+    conn = sqlite3.connect(u.db_name)
+    assert conn.execute('SELECT DISTINCT id_contract FROM contract_date').fetchall() == [(id_live,)]
+    
+    res = conn.execute('SELECT id_contract, Rows, Series FROM contract_archive').fetchall()
+    conn.close()
+    
+    assert len(res) == 1 and res[0][0] == id_expired and res[0][1] == 3
+    
+    df = decode_series(res[0][1], res[0][2])
+    assert list(df['Date']) == [datetime.date(2020, 1, d) for d in (1, 2, 3)]
+    assert list(df['Price']) == [51.0, 52.0, 53.0]
+    assert list(df['OpenInterest']) == [100, 200, 300]
+    assert list(df['Volume']) == [10, 20, 30]
+
+def test_archive_expired_late_rows(tmp_path):
+    """Rows written after a contract was archived are folded into its blob, 
+    the archived value is kept for a date in both"""
+    
+    u, id_expired, id_live = make_market(tmp_path / 'MarketData.db')
+    u.archive_expired()
+    
+    conn = sqlite3.connect(u.db_name)
+    conn.execute("INSERT INTO Date (Date) VALUES ('2020-01-04')")
+    conn.execute('INSERT INTO contract_date VALUES (54.0, 400, 40, 4, ?)', (id_expired,))
+    conn.execute('INSERT INTO contract_date VALUES (99.0, 0, 0, 1, ?)', (id_expired,))
+    conn.commit()
+    conn.close()
+    
+    u.archive_expired()
+    
+    conn = sqlite3.connect(u.db_name)
+    assert conn.execute('SELECT COUNT(*) FROM contract_date WHERE id_contract = ?', (id_expired,)).fetchall() == [(0,)]
+    n, blob = conn.execute('SELECT Rows, Series FROM contract_archive').fetchall()[0]
+    conn.close()
+    
+    assert n == 4
+    assert list(decode_series(n, blob)['Price']) == [51.0, 52.0, 53.0, 54.0]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Round-trip checks of the compressed storage of expired contracts.
+"""
+
+# Import librairies
+import datetime
+import pytest
+
+from Cold_Storage import encode_series, decode_series
+
+def make_rows():
+    """Daily rows of a fake contract, with gaps for the week-ends"""
+    
+    d0 = datetime.date(2017, 1, 2)
+    dts = [d0 + datetime.timedelta(days = i) for i in range(40) if (d0 + datetime.timedelta(days = i)).weekday() < 5]
+    
+    return [(d, 50.0 + 0.25 * i, 1000 + i, 10 * i) for i, d in enumerate(dts)]
+
+def test_round_trip():
+    """Decoding an encoded series gives back the same rows"""
+    
+    rows = make_rows()
+    n, blob = encode_series(rows)
+    df = decode_series(n, blob)
+    
+    assert n == len(rows)
+    assert list(df.columns) == ['Date', 'Price', 'OpenInterest', 'Volume']
+    assert [tuple(x) for x in df.itertuples(index = False)] == rows
+
+def test_round_trip_empty():
+    """An empty series is stored and read back"""
+    
+    n, blob = encode_series([])
+    
+    assert n == 0
+    assert len(decode_series(n, blob)) == 0
+
+def test_wrong_number_of_rows():
+    """A blob read with the wrong number of rows is rejected"""
+    
+    n, blob = encode_series(make_rows())
+    
+    with pytest.raises(AssertionError):
+        decode_series(n + 1, blob)
+
+def test_unknown_version():
+    """A blob with an unknown format version is rejected"""
+    
+    n, blob = encode_series(make_rows())
+    
+    with pytest.raises(AssertionError):
+        decode_series(n, bytes([0]) + blob[1:])
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the extraction of archived and live contracts, on a small 
+synthetic database.
+"""
+
+# Import librairies
+import sqlite3
+import datetime
+
+from CME_Uploader import Uploader
+from DB_Extractor import DB_to_Excel
+
+def make_market(db_name):
+    """Database with an expired and a live CL contract over three dates, 
+    with the expired one archived"""
+    
+    u = object.__new__(Uploader)
+    u.db_name = str(db_name)
+    
+    conn = sqlite3.connect(u.db_name)
+    c = conn.cursor()
+    u.create_tables(c)
+    
+    for d in (1, 2, 3):
+        c.execute('INSERT INTO Date (Date) VALUES (?)', (datetime.date(2020, 1, d),))
+    c.execute("INSERT INTO RootCommodity (Name, Market, Alias) VALUES ('Crude Oil', 'CME', 'CL')")
+    
+    for m, yr in [('F', 2020), ('Z', datetime.date.today().year + 1)]:
+        c.execute('INSERT INTO Contract (Month, Year, id_root) VALUES (?, ?, 1)', (m, yr))
+        id_contract = c.lastrowid
+        for id_date in (1, 2, 3):
+            c.execute('INSERT INTO contract_date (Price, OpenInterest, Volume, id_date, id_contract) VALUES (?,?,?,?,?)',
+                      (50.0 + id_date, 100 * id_date, 10 * id_date, id_date, id_contract))
+            
+    conn.commit()
+    conn.close()
+    
+    u.archive_expired()
+
+def make_extractor(db_name):
+    """Extractor without changing the working directory"""
+    
+    ext = object.__new__(DB_to_Excel)
+    ext.db_name = str(db_name)
+    
+    return ext
+
+def test_request_contract_archived(tmp_path):
+    """An archived contract is read back from its blob"""
+    
+    make_market(tmp_path / 'MarketData.db')
+    df = make_extractor(tmp_path / 'MarketData.db').request_contract('CLF2020')
+    
+    assert list(df.index) == [datetime.date(2020, 1, d) for d in (1, 2, 3)]
+    assert list(df['Price']) == [51.0, 52.0, 53.0]
+    assert list(df['OpenInterest']) == [100, 200, 300]
+    assert list(df['Volume']) == [10, 20, 30]
+
+def test_request_contract_live(tmp_path):
+    """A live contract is read from contract_date"""
+    
+    make_market(tmp_path / 'MarketData.db')
+    alias = 'CLZ' + str(datetime.date.today().year + 1)
+    df = make_extractor(tmp_path / 'MarketData.db').request_contract(alias)
+    
+    assert list(df.index) == [datetime.date(2020, 1, d) for d in (1, 2, 3)]
+    assert list(df['Price']) == [51.0, 52.0, 53.0]
+
+def test_request_contract_late_rows(tmp_path):
+    """Rows written after a contract was archived are added to the blob, the
+    archived value is kept for a date in both"""
+    
+    make_market(tmp_path / 'MarketData.db')
+    
+    conn = sqlite3.connect(str(tmp_path / 'MarketData.db'))
+    conn.execute("INSERT INTO Date (Date) VALUES ('2020-01-04')")
+    conn.execute('INSERT INTO contract_date VALUES (54.0, 400, 40, 4, 1)')
+    conn.execute('INSERT INTO contract_date VALUES (99.0, 0, 0, 1, 1)')
+    conn.commit()
+    conn.close()
+    
+    df = make_extractor(tmp_path / 'MarketData.db').request_contract('CLF2020')
+    
+    assert list(df.index) == [datetime.date(2020, 1, d) for d in (1, 2, 3, 4)]
+    assert list(df['Price']) == [51.0, 52.0, 53.0, 54.0]